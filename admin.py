@@ -0,0 +1,39 @@
+"""Access control for operational endpoints.
+
+Admin endpoints are only reachable when ADMIN_TOKEN is configured, and
+only with an `Authorization: Bearer <ADMIN_TOKEN>` header. Without a
+configured token they answer 404, as if they didn't exist.
+"""
+
+from functools import wraps
+from hmac import compare_digest
+
+from flask import abort, current_app, request
+
+
+def is_admin_request():
+    """Does this request carry the configured admin token?"""
+
+    token = current_app.config.get('ADMIN_TOKEN')
+
+    if not token:
+        return False
+
+    header = request.headers.get('Authorization', '')
+    scheme, _, supplied = header.partition(' ')
+
+    return scheme.lower() == 'bearer' and compare_digest(supplied, token)
+
+
+def admin_required(view):
+    """Decorate a view so only admin requests can reach it."""
+
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_app.config.get('ADMIN_TOKEN'):
+            abort(404)
+        if not is_admin_request():
+            abort(403)
+        return view(*args, **kwargs)
+
+    return wrapped
@@ -1,13 +1,33 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import (
+    Flask, render_template, request, flash, redirect, session, g, jsonify,
+)
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
+from admin import admin_required
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm, TokenValidationForm
-from models import db, connect_db, User, Message, LikedMessage
+from models import db, connect_db, User, Message, LikedMessage, Follows
+import counters
+import pooling
+import fragments
+import http_caching
+import identity
+import loader
+import passwords
+import replicas
+import search
+import timeline
+from pagination import (
+    decode_message_cursor, make_page, message_cursor, messages_per_page,
+    next_page_url, paginate_messages, paginate_users,
+)
 
 CURR_USER_KEY = "curr_user"
+BUSY_MESSAGE = "We're very busy right now. Please try again in a moment."
 
 
 # Get DB_URI from environ variable (useful for production/testing) or,
@@ -16,15 +36,55 @@ database_url = os.environ.get('DATABASE_URL', 'postgresql:///warbler')
 database_url = database_url.replace('postgres://', 'postgresql://')
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+# Optional read replicas, e.g. "postgresql:///warbler-r1,postgresql:///warbler-r2"
+replica_urls = os.environ.get('DATABASE_REPLICA_URLS')
+if replica_urls:
+    replicas.configure(app, [
+        url.strip().replace('postgres://', 'postgresql://')
+        for url in replica_urls.split(',')
+    ])
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+# Accounts with more followers than this are merged into feeds at read time
+app.config['TIMELINE_FANOUT_LIMIT'] = int(
+    os.environ.get('TIMELINE_FANOUT_LIMIT', timeline.DEFAULT_FANOUT_LIMIT))
+# bcrypt cost, and the per-worker process pool that runs it
+app.config['BCRYPT_LOG_ROUNDS'] = int(
+    os.environ.get('BCRYPT_LOG_ROUNDS', passwords.DEFAULT_LOG_ROUNDS))
+app.config['BCRYPT_POOL_SIZE'] = int(
+    os.environ.get('BCRYPT_POOL_SIZE', passwords.DEFAULT_POOL_SIZE))
+app.config['BCRYPT_MAX_PENDING'] = int(
+    os.environ.get('BCRYPT_MAX_PENDING', passwords.DEFAULT_MAX_PENDING))
+# Shared cache for rendered message fragments; in-process LRU if unset
+app.config['FRAGMENT_CACHE_URL'] = os.environ.get('FRAGMENT_CACHE_URL')
+# Browser/CDN caching of static files and public pages, in seconds
+app.config['STATIC_MAX_AGE'] = int(
+    os.environ.get('STATIC_MAX_AGE', http_caching.DEFAULT_STATIC_MAX_AGE))
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = app.config['STATIC_MAX_AGE']
+app.config['PUBLIC_MAX_AGE'] = int(
+    os.environ.get('PUBLIC_MAX_AGE', http_caching.DEFAULT_PUBLIC_MAX_AGE))
+# Connection pool tuning; see pooling.py. DB_POOLER_MODE=transaction when
+# connecting through a transaction pooler such as PgBouncer
+for name, cast in (('DB_POOL_SIZE', int),
+                   ('DB_MAX_OVERFLOW', int),
+                   ('DB_POOL_TIMEOUT', float),
+                   ('DB_POOL_RECYCLE', int),
+                   ('DB_STATEMENT_TIMEOUT', int),
+                   ('DB_POOLER_MODE', str)):
+    if os.environ.get(name):
+        app.config[name] = cast(os.environ[name])
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING') != '0'
+# Bearer token for /admin endpoints; they 404 when unset
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+replicas.init_app(app)
+fragments.init_app(app)
 
 
 ##############################################################################
@@ -33,10 +93,14 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    g.user is an identity.CurrentUser: its id, username and image_url come
+    from a per-worker cache, and the full row is loaded only if needed.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = identity.current_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -48,6 +112,24 @@ def do_login(user):
     session[CURR_USER_KEY] = user.id
 
 
+def get_liked_ids(messages):
+    """Ids of the given messages that the current user has liked."""
+
+    if not g.user:
+        return set()
+
+    return g.user.liked_message_ids([msg.id for msg in messages])
+
+
+def get_following_ids(users):
+    """Ids of the given users that the current user follows."""
+
+    if not g.user:
+        return set()
+
+    return g.user.followed_ids([user.id for user in users])
+
+
 def do_logout():
     """Logout user."""
 
@@ -86,6 +168,10 @@ def signup():
                 flash("Please use a different username", 'danger')
             return render_template('users/signup.html', form=form)
 
+        except passwords.PasswordServiceBusy:
+            flash(BUSY_MESSAGE, 'danger')
+            return render_template('users/signup.html', form=form), 503
+
         do_login(user)
 
         return redirect("/")
@@ -101,10 +187,16 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except passwords.PasswordServiceBusy:
+            flash(BUSY_MESSAGE, 'danger')
+            return render_template('users/login.html', form=form), 503
 
         if user:
+            # Saves the password hash if authenticate upgraded its cost
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -134,27 +226,64 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username (best
+    matches first), and a 'cursor' param for the next page.
     """
 
-    search = request.args.get('q')
+    search_term = request.args.get('q')
     form = TokenValidationForm()
 
-    if not search:
-        users = User.query.all()
+    if search_term:
+        page = search.search_users(search_term, request.args.get('cursor'))
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = paginate_users(User.query, request.args.get('cursor'))
+
+    return render_template('users/index.html',
+                           users=page.items,
+                           next_url=next_page_url(page),
+                           following_ids=get_following_ids(page.items),
+                           form=form)
 
-    return render_template('users/index.html', users=users, form=form)
+
+@app.route('/users/autocomplete')
+def users_autocomplete():
+    """Return JSON of users whose username starts with the 'q' param.
+
+    For search box typeahead: {"users": [{id, username, image_url}, ...]}
+    """
+
+    users = search.autocomplete(request.args.get('q'))
+
+    return jsonify(users=[
+        dict(id=user.id, username=user.username, image_url=user.image_url)
+        for user in users
+    ])
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
+
+    Logged-out viewers get validators, and a 304 if their copy is current.
+    """
+
+    not_modified = http_caching.check_public_page(
+        http_caching.user_page_validators, user_id)
+    if not_modified:
+        return not_modified
 
     user = User.query.get_or_404(user_id)
     form = TokenValidationForm()
-    return render_template('users/show.html', user=user, form=form)
+
+    page = paginate_messages(Message.query.filter(Message.user_id == user.id),
+                             request.args.get('cursor'))
+
+    return render_template('users/show.html',
+                           user=user,
+                           messages=page.items,
+                           liked_ids=get_liked_ids(page.items),
+                           next_url=next_page_url(page),
+                           form=form)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -168,7 +297,18 @@ def show_following(user_id):
     form = TokenValidationForm()
     user = User.query.get_or_404(user_id)
 
-    return render_template('users/following.html', user=user, form=form)
+    page = paginate_users(
+        User.query
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .filter(Follows.user_following_id == user.id),
+        request.args.get('cursor'))
+
+    return render_template('users/following.html',
+                           user=user,
+                           users=page.items,
+                           next_url=next_page_url(page),
+                           following_ids=get_following_ids(page.items),
+                           form=form)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -182,7 +322,18 @@ def users_followers(user_id):
     form = TokenValidationForm()
     user = User.query.get_or_404(user_id)
 
-    return render_template('users/followers.html', user=user, form=form)
+    page = paginate_users(
+        User.query
+        .join(Follows, Follows.user_following_id == User.id)
+        .filter(Follows.user_being_followed_id == user.id),
+        request.args.get('cursor'))
+
+    return render_template('users/followers.html',
+                           user=user,
+                           users=page.items,
+                           next_url=next_page_url(page),
+                           following_ids=get_following_ids(page.items),
+                           form=form)
 
 
 @app.route('/users/<int:user_id>/likes')
@@ -196,7 +347,19 @@ def users_likes(user_id):
     form = TokenValidationForm()
     user = User.query.get_or_404(user_id)
 
-    return render_template('users/likes.html', user=user, form=form)
+    page = paginate_messages(
+        Message.query
+        .options(joinedload(Message.user))
+        .join(LikedMessage, LikedMessage.message_id == Message.id)
+        .filter(LikedMessage.user_id == user.id),
+        request.args.get('cursor'))
+
+    return render_template('users/likes.html',
+                           user=user,
+                           messages=page.items,
+                           liked_ids=get_liked_ids(page.items),
+                           next_url=next_page_url(page),
+                           form=form)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -209,6 +372,10 @@ def add_follow(follow_id):
 
     followed_user = User.query.get_or_404(follow_id)
     g.user.following.append(followed_user)
+    counters.adjust(g.user.id, following_count=1)
+    counters.adjust(followed_user.id, followers_count=1)
+    db.session.flush()
+    timeline.backfill(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -224,6 +391,9 @@ def stop_following(follow_id):
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    counters.adjust(g.user.id, following_count=-1)
+    counters.adjust(followed_user.id, followers_count=-1)
+    timeline.prune(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -237,18 +407,26 @@ def edit_profile():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    form = UserEditForm(obj=g.user)
+    user = g.user.record
+    form = UserEditForm(obj=user)
 
     if form.validate_on_submit():
-        if User.authenticate(g.user.username, form.password.data):
+        try:
+            is_auth = User.authenticate(user.username, form.password.data)
+        except passwords.PasswordServiceBusy:
+            flash(BUSY_MESSAGE, 'danger')
+            return render_template('users/edit.html', form=form, user=user), 503
+
+        if is_auth:
             try:
-                g.user.username = form.username.data
-                g.user.email = form.email.data
-                g.user.image_url = form.image_url.data
-                g.user.header_image_url = form.header_image_url.data
-                g.user.bio = form.bio.data
+                user.username = form.username.data
+                user.email = form.email.data
+                user.image_url = form.image_url.data
+                user.header_image_url = form.header_image_url.data
+                user.bio = form.bio.data
 
                 db.session.commit()
+                identity.invalidate(user.id)
 
             # TODO: catch this error at a higher level, in form or model
             except IntegrityError as exc:
@@ -260,13 +438,13 @@ def edit_profile():
                 return render_template('users/edit.html', form=form)
 
             flash("Update successful!", "success")
-            return redirect(f'/users/{g.user.id}')
+            return redirect(f'/users/{user.id}')
 
         else:
             flash("Error: Incorrect Password", "danger")
             return redirect('/')
 
-    return render_template("users/edit.html", form=form, user=g.user)
+    return render_template("users/edit.html", form=form, user=user)
 
 
 @app.route('/users/delete', methods=["POST"])
@@ -280,12 +458,14 @@ def delete_user():
     form = TokenValidationForm()
     if form.validate_on_submit():
 
+        counters.user_deleted(g.user.id)
         Message.query.filter(Message.user_id == g.user.id).delete()
 
         do_logout()
 
-        db.session.delete(g.user)
+        db.session.delete(g.user.record)
         db.session.commit()
+        identity.invalidate(g.user.id)
 
     return redirect("/signup")
 
@@ -309,6 +489,9 @@ def messages_add():
     if form.validate_on_submit():
             msg = Message(text=form.text.data)
             g.user.messages.append(msg)
+            db.session.flush()
+            counters.adjust(g.user.id, messages_count=1)
+            timeline.fan_out_message(msg)
             db.session.commit()
             flash("New Message Added!", "success")
 
@@ -319,11 +502,24 @@ def messages_add():
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
-    """Show a message."""
+    """Show a message.
+
+    Logged-out viewers get validators, and a 304 if their copy is current.
+    """
+
+    not_modified = http_caching.check_public_page(
+        http_caching.message_page_validators, message_id)
+    if not_modified:
+        return not_modified
 
     form = TokenValidationForm()
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg, form=form)
+    msg = (Message.query
+           .options(joinedload(Message.user))
+           .get_or_404(message_id))
+    return render_template('messages/show.html',
+                           message=msg,
+                           liked_ids=get_liked_ids([msg]),
+                           form=form)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -335,6 +531,8 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    counters.message_deleted(msg)
+    timeline.remove_message(msg.id)
     db.session.delete(msg)
     db.session.commit()
     flash("Message Deleted!", "success")
@@ -355,6 +553,7 @@ def messages_like(message_id):
     if form.validate_on_submit():
         liked_message = LikedMessage(user_id=g.user.id, message_id=message_id)
         db.session.add(liked_message)
+        counters.adjust(g.user.id, likes_count=1)
         db.session.commit()
         flash("Message liked!", "success")
 
@@ -382,6 +581,7 @@ def messages_unlike(message_id):
                         LikedMessage.message_id == message_id).one()
 
         db.session.delete(liked_message)
+        counters.adjust(g.user.id, likes_count=-1)
         db.session.commit()
         flash("Message unliked!", "success")
     if referrer:
@@ -398,37 +598,93 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, read from
+      the user's materialized timeline; 'cursor' param for older pages
     """
 
     form = TokenValidationForm()
 
     if g.user:
-        following_user_ids = [u.id for u in g.user.following] + [g.user.id]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_user_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages, form=form)
+        per_page = messages_per_page()
+        messages = timeline.home_timeline(
+            g.user.id,
+            limit=per_page + 1,
+            before=decode_message_cursor(request.args.get('cursor')))
+        page = make_page(messages, per_page, message_cursor)
+
+        return render_template('home.html',
+                               messages=page.items,
+                               liked_ids=get_liked_ids(page.items),
+                               next_url=next_page_url(page),
+                               form=form)
 
     else:
         return render_template('home-anon.html', form=form)
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Admin endpoints
+
+
+@app.route('/admin/pool')
+@admin_required
+def admin_pool_stats():
+    """Show connection pool size, checkout latency, waiters and overflow
+    for this worker's primary and replica engines, as JSON."""
+
+    engines = {'primary': db.get_engine()}
+    for name in app.config.get('SQLALCHEMY_REPLICA_BINDS') or []:
+        engines[name] = db.get_engine(bind=name)
+
+    return jsonify({name: pooling.pool_stats(engine)
+                    for name, engine in engines.items()})
+
+
+##############################################################################
+# Maintenance commands
+
+
+@app.cli.command('load-data')
+@click.option('--data-dir', default='generator', show_default=True,
+              help='Directory holding users.csv, messages.csv, ...')
+@click.option('--chunk-size', default=loader.DEFAULT_CHUNK_SIZE,
+              show_default=True, help='Rows sent to the database at a time.')
+def load_data_command(data_dir, chunk_size):
+    """Drop the database and bulk load it from CSV files."""
+
+    loader.load(data_dir, chunk_size, report=click.echo)
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines_command():
+    """Rebuild every user's home timeline from messages and follows."""
+
+    timeline.rebuild_timelines()
+    db.session.commit()
+
+
+@app.cli.command('create-search-indexes')
+def create_search_indexes_command():
+    """Create the username search indexes on an existing database."""
+
+    with db.engine.begin() as connection:
+        search.create_search_indexes(connection)
+
+
+@app.cli.command('reconcile-counts')
+def reconcile_counts_command():
+    """Rebuild users' message, follow and like counters."""
+
+    counters.reconcile()
+    db.session.commit()
+
+
+##############################################################################
+# HTTP caching policy
+
 
 @app.after_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Add caching headers to every response (see http_caching)."""
 
-    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
-    return response
+    return http_caching.apply_policy(response)
@@ -0,0 +1,103 @@
+"""Denormalized per-user counters for Warbler.
+
+`users` carries messages_count, following_count, followers_count and
+likes_count so profile stats don't load whole relationships just to count
+them. The routes adjust them with atomic `col = col + n` updates in the
+same transaction as the write they count; `reconcile()` rebuilds them from
+`messages`, `follows` and `liked_messages`.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from models import db, User, Message, Follows, LikedMessage
+
+
+def adjust(user_id, **deltas):
+    """Atomically add `deltas` (e.g. followers_count=1) to a user's counters."""
+
+    values = {getattr(User, name): getattr(User, name) + delta
+              for name, delta in deltas.items()}
+    values[User.updated_at] = datetime.utcnow()
+
+    (User.query
+     .filter(User.id == user_id)
+     .update(values, synchronize_session=False))
+
+
+def message_deleted(msg):
+    """Adjust counters before `msg` (and the likes of it) are deleted."""
+
+    adjust(msg.user_id, messages_count=-1)
+
+    likers = (select(LikedMessage.user_id)
+              .where(LikedMessage.message_id == msg.id))
+
+    (User.query
+     .filter(User.id.in_(likers))
+     .update({User.likes_count: User.likes_count - 1,
+              User.updated_at: datetime.utcnow()},
+             synchronize_session=False))
+
+
+def user_deleted(user_id):
+    """Adjust the counters of everyone connected to a user being deleted."""
+
+    followers = (select(Follows.user_following_id)
+                 .where(Follows.user_being_followed_id == user_id))
+
+    (User.query
+     .filter(User.id.in_(followers))
+     .update({User.following_count: User.following_count - 1,
+              User.updated_at: datetime.utcnow()},
+             synchronize_session=False))
+
+    followed = (select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == user_id))
+
+    (User.query
+     .filter(User.id.in_(followed))
+     .update({User.followers_count: User.followers_count - 1,
+              User.updated_at: datetime.utcnow()},
+             synchronize_session=False))
+
+    likes_of_user_messages = (
+        select(func.count())
+        .select_from(LikedMessage)
+        .join(Message, Message.id == LikedMessage.message_id)
+        .where(Message.user_id == user_id,
+               LikedMessage.user_id == User.id)
+        .scalar_subquery())
+
+    likers = (select(LikedMessage.user_id)
+              .join(Message, Message.id == LikedMessage.message_id)
+              .where(Message.user_id == user_id))
+
+    (User.query
+     .filter(User.id.in_(likers))
+     .update({User.likes_count: User.likes_count - likes_of_user_messages,
+              User.updated_at: datetime.utcnow()},
+             synchronize_session=False))
+
+
+def reconcile():
+    """Rebuild every user's counters from the underlying tables."""
+
+    def count_of(model, where):
+        return (select(func.count())
+                .select_from(model)
+                .where(where)
+                .scalar_subquery())
+
+    (User.query
+     .update({
+         User.messages_count: count_of(Message, Message.user_id == User.id),
+         User.following_count: count_of(
+             Follows, Follows.user_following_id == User.id),
+         User.followers_count: count_of(
+             Follows, Follows.user_being_followed_id == User.id),
+         User.likes_count: count_of(
+             LikedMessage, LikedMessage.user_id == User.id),
+         User.updated_at: datetime.utcnow(),
+     }, synchronize_session=False))
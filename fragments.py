@@ -0,0 +1,108 @@
+"""Rendered-fragment cache for message list items.
+
+A message never changes after it is posted, so the HTML for its list item
+(author avatar, username, date and text; templates/messages/item.html) is
+rendered once and reused. The per-viewer like button is not part of the
+fragment and is still rendered on every request.
+
+Keys combine the message id, FRAGMENT_VERSION (bump it when item.html
+changes) and a digest of the author's username and avatar, so profile
+edits show up without explicit invalidation.
+
+Backends: an in-process LRU (the default) or a shared cache such as Redis
+when FRAGMENT_CACHE_URL is set. Any object with `get(key)` and
+`set(key, value)` can be installed as app.config['FRAGMENT_CACHE_BACKEND'].
+"""
+
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+
+from flask import current_app, render_template
+from markupsafe import Markup
+
+FRAGMENT_VERSION = 1
+
+DEFAULT_LRU_SIZE = 10000
+DEFAULT_SHARED_TTL = 24 * 60 * 60
+
+
+class LRUBackend:
+    """Bounded in-process cache; least recently used entries are evicted."""
+
+    def __init__(self, max_entries=DEFAULT_LRU_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    """Cache shared by every worker, in Redis (needs the `redis` package)."""
+
+    def __init__(self, url, ttl=DEFAULT_SHARED_TTL, prefix='warbler:fragment:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+
+def init_app(app):
+    """Install the configured backend and the `message_fragment` template
+    global on `app`."""
+
+    if 'FRAGMENT_CACHE_BACKEND' not in app.config:
+        url = app.config.get('FRAGMENT_CACHE_URL')
+        app.config['FRAGMENT_CACHE_BACKEND'] = (
+            RedisBackend(url) if url else
+            LRUBackend(app.config.get('FRAGMENT_CACHE_SIZE', DEFAULT_LRU_SIZE)))
+
+    app.jinja_env.globals['message_fragment'] = render_message
+
+
+def message_key(message):
+    author = message.user
+    digest = blake2b(f"{author.username}\0{author.image_url}".encode(),
+                     digest_size=6).hexdigest()
+
+    return f"message:{message.id}:v{FRAGMENT_VERSION}:{digest}"
+
+
+def render_message(message):
+    """Return the list-item HTML for `message`, from the cache if possible."""
+
+    backend = current_app.config['FRAGMENT_CACHE_BACKEND']
+    key = message_key(message)
+
+    html = backend.get(key)
+
+    if html is None:
+        html = render_template('messages/item.html', message=message)
+        backend.set(key, html)
+
+    return Markup(html)
@@ -0,0 +1,139 @@
+"""HTTP caching policy for Warbler responses.
+
+- /static files: public, cacheable for STATIC_MAX_AGE seconds
+- public pages (profiles and single messages, viewed logged out): an ETag
+  and Last-Modified built from a cheap query for the newest relevant
+  message / user change; `If-None-Match` / `If-Modified-Since` requests
+  that still match get a 304 before anything is rendered
+- pages for a logged-in user: `private, no-cache`
+- anything else (forms with CSRF tokens, flashed messages): `no-store`
+"""
+
+from hashlib import blake2b
+
+from flask import abort, current_app, g, request, session
+from sqlalchemy import func, select
+
+from models import db, User, Message
+
+DEFAULT_STATIC_MAX_AGE = 7 * 24 * 60 * 60
+DEFAULT_PUBLIC_MAX_AGE = 60
+
+
+def _is_public_request():
+    """Could this response be shared between viewers?"""
+
+    return (request.method in ('GET', 'HEAD')
+            and not g.get('user')
+            and '_flashes' not in session)
+
+
+def conditional(last_modified, *etag_parts):
+    """Set the validators of a public page, and check the request's.
+
+    Returns a 304 response if the client's copy is still current, else
+    None (render the page as usual). Does nothing for logged-in viewers.
+    """
+
+    if not _is_public_request():
+        return None
+
+    digest = blake2b(digest_size=12)
+    for part in (request.full_path, last_modified, *etag_parts):
+        digest.update(repr(part).encode())
+
+    g.cache_validators = (digest.hexdigest(), last_modified)
+
+    response = current_app.response_class(status=200)
+    _set_public_headers(response)
+    response.make_conditional(request)
+
+    return response if response.status_code == 304 else None
+
+
+def check_public_page(validators_for, key):
+    """Handle a conditional request for a public page.
+
+    `validators_for(key)` returns the page's validators, or None if the
+    page doesn't exist (aborts with a 404). Returns a 304 response or None;
+    logged-in viewers always get None, without running the query.
+    """
+
+    if not _is_public_request():
+        return None
+
+    validators = validators_for(key)
+    if validators is None:
+        abort(404)
+
+    return conditional(*validators)
+
+
+def user_page_validators(user_id):
+    """(last modified, ) for a user's profile pages, or None if no such
+    user. One indexed query."""
+
+    latest_message = (select(func.max(Message.timestamp))
+                      .where(Message.user_id == user_id)
+                      .scalar_subquery())
+
+    row = (db.session
+           .query(User.updated_at, latest_message)
+           .filter(User.id == user_id)
+           .first())
+
+    if row is None:
+        return None
+
+    updated_at, message_at = row
+    return (max(updated_at, message_at or updated_at),)
+
+
+def message_page_validators(message_id):
+    """(last modified, ) for a single message page, or None if no such
+    message. One indexed query."""
+
+    row = (db.session
+           .query(Message.timestamp, User.updated_at)
+           .join(User, User.id == Message.user_id)
+           .filter(Message.id == message_id)
+           .first())
+
+    if row is None:
+        return None
+
+    return (max(row),)
+
+
+def _set_public_headers(response):
+    etag, last_modified = g.cache_validators
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get(
+        'PUBLIC_MAX_AGE', DEFAULT_PUBLIC_MAX_AGE)
+    response.vary.add('Cookie')
+
+
+def apply_policy(response):
+    """Set Cache-Control (and validators) on a finished response."""
+
+    if request.endpoint == 'static':
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config.get(
+            'STATIC_MAX_AGE', DEFAULT_STATIC_MAX_AGE)
+
+    elif g.get('cache_validators') and response.status_code in (200, 304):
+        _set_public_headers(response)
+
+    elif g.get('user'):
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+
+    else:
+        # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
+        response.cache_control.no_store = True
+
+    return response
@@ -0,0 +1,105 @@
+"""Cached identity of the logged-in user.
+
+Every request used to load the current user's row before running the
+route. Instead, each worker keeps a short-lived summary of the fields
+base.html and most routes read (IDENTITY_FIELDS) and puts a CurrentUser in
+`g.user`; the full row is only loaded when a route reads anything else.
+
+Entries expire after IDENTITY_CACHE_TTL seconds, and are dropped at once
+by `invalidate()` when a profile is edited or deleted, so other workers
+see changes within the TTL.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from flask import current_app
+
+from models import User
+
+IDENTITY_FIELDS = ('id', 'username', 'image_url')
+
+DEFAULT_TTL = 30
+DEFAULT_MAX_ENTRIES = 10000
+
+_cache = OrderedDict()
+_lock = Lock()
+
+
+class CurrentUser:
+    """The logged-in user.
+
+    Reads of IDENTITY_FIELDS come from the cached summary; anything else
+    (relationships, counters, methods) loads the full User row once and
+    delegates to it.
+    """
+
+    def __init__(self, summary, user=None):
+        self._summary = summary
+        self._user = user
+
+    def __getattr__(self, name):
+        if name in self._summary:
+            return self._summary[name]
+
+        return getattr(self.record, name)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    @property
+    def record(self):
+        """The full User row, loaded on first use."""
+
+        if self._user is None:
+            self._user = User.query.get(self.id)
+
+        return self._user
+
+
+def _config(name, default):
+    return current_app.config.get(name, default)
+
+
+def summarize(user):
+    return {field: getattr(user, field) for field in IDENTITY_FIELDS}
+
+
+def current_user(user_id):
+    """Return a CurrentUser for `user_id`, or None if there's no such user.
+
+    Only queries the database when this worker has no fresh summary.
+    """
+
+    now = monotonic()
+
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry and entry[0] > now:
+            _cache.move_to_end(user_id)
+            return CurrentUser(entry[1])
+
+    user = User.query.get(user_id)
+
+    if user is None:
+        invalidate(user_id)
+        return None
+
+    summary = summarize(user)
+    expires_at = now + _config('IDENTITY_CACHE_TTL', DEFAULT_TTL)
+
+    with _lock:
+        _cache[user_id] = (expires_at, summary)
+        _cache.move_to_end(user_id)
+        while len(_cache) > _config('IDENTITY_CACHE_SIZE', DEFAULT_MAX_ENTRIES):
+            _cache.popitem(last=False)
+
+    return CurrentUser(summary, user)
+
+
+def invalidate(user_id):
+    """Forget this worker's cached summary of `user_id`."""
+
+    with _lock:
+        _cache.pop(user_id, None)
@@ -0,0 +1,197 @@
+"""Streaming bulk loader for Warbler's CSV datasets.
+
+Loads generator/users.csv, messages.csv, follows.csv and (if present)
+likes.csv into a fresh schema:
+
+1. tables are created without secondary indexes or foreign keys
+2. each CSV is streamed in chunks: PostgreSQL gets `COPY ... FROM STDIN`,
+   other databases (SQLite) a batched executemany
+3. indexes and foreign keys are added once the data is in
+4. counters and timelines are rebuilt, then their indexes are added
+5. id sequences are moved past the loaded ids
+
+Rows without an `id` column are numbered in file order, which is how the
+CSVs refer to each other (messages.user_id is a users.csv line number).
+"""
+
+import csv
+import io
+import os
+from datetime import datetime
+from time import perf_counter
+
+from sqlalchemy import DateTime, Integer, text
+from sqlalchemy.schema import AddConstraint, CreateIndex, CreateTable
+
+import counters
+import search
+import timeline
+from models import db
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# Table name -> CSV file name, in load order
+CSV_FILES = (
+    ('users', 'users.csv'),
+    ('messages', 'messages.csv'),
+    ('follows', 'follows.csv'),
+    ('liked_messages', 'likes.csv'),
+)
+
+# Tables filled from the others after loading; indexed last
+DERIVED_TABLES = ('timelines',)
+
+
+def _is_postgres(conn):
+    return conn.dialect.name == 'postgresql'
+
+
+def _create_bare_tables(conn):
+    """Create every table with only its primary key and unique
+    constraints (and, where ALTER TABLE can't add them later, its foreign
+    keys)."""
+
+    for table in db.Model.metadata.sorted_tables:
+        if _is_postgres(conn):
+            conn.execute(CreateTable(table,
+                                     include_foreign_key_constraints=[]))
+        else:
+            conn.execute(CreateTable(table))
+
+
+def _add_indexes_and_keys(conn, tables):
+    for table in tables:
+        for index in table.indexes:
+            conn.execute(CreateIndex(index))
+
+        if _is_postgres(conn):
+            for constraint in table.foreign_key_constraints:
+                conn.execute(AddConstraint(constraint))
+
+
+def _read_chunks(path, table, chunk_size):
+    """Yield (columns, rows) chunks of the CSV at `path`, adding ids
+    numbered from 1 if the file has none."""
+
+    with open(path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        columns = next(reader)
+
+        add_ids = 'id' not in columns and 'id' in table.c and \
+            table.c.id.primary_key and len(table.primary_key.columns) == 1
+        if add_ids:
+            columns = ['id'] + columns
+
+        chunk = []
+        for number, row in enumerate(reader, start=1):
+            chunk.append([str(number)] + row if add_ids else row)
+            if len(chunk) >= chunk_size:
+                yield columns, chunk
+                chunk = []
+
+        if chunk:
+            yield columns, chunk
+
+
+def _copy_chunk(conn, table, columns, rows):
+    """Send rows to PostgreSQL with COPY FROM STDIN."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {table.name} ({column_list}) FROM STDIN WITH (FORMAT csv)',
+            buffer)
+
+
+def _converter(column):
+    if isinstance(column.type, DateTime):
+        return lambda value: datetime.fromisoformat(value) if value else None
+    if isinstance(column.type, Integer):
+        return lambda value: int(value) if value else None
+    return lambda value: value if value != '' else None
+
+
+def _insert_chunk(conn, table, columns, rows):
+    """Insert rows with one batched executemany."""
+
+    converters = [_converter(table.c[column]) for column in columns]
+
+    conn.execute(table.insert(), [
+        {column: convert(value)
+         for column, convert, value in zip(columns, converters, row)}
+        for row in rows
+    ])
+
+
+def _load_table(conn, table, path, chunk_size, report):
+    write_chunk = _copy_chunk if _is_postgres(conn) else _insert_chunk
+    start = perf_counter()
+    loaded = 0
+
+    for columns, rows in _read_chunks(path, table, chunk_size):
+        write_chunk(conn, table, columns, rows)
+        loaded += len(rows)
+
+    seconds = perf_counter() - start
+    report(f"{table.name}: {loaded:,} rows in {seconds:.1f}s "
+           f"({loaded / max(seconds, 1e-9):,.0f} rows/s)")
+
+
+def _reset_sequences(conn):
+    """Move serial id sequences past the largest loaded id."""
+
+    if not _is_postgres(conn):
+        return
+
+    for table in db.Model.metadata.sorted_tables:
+        if 'id' in table.c and table.c.id.autoincrement and \
+                len(table.primary_key.columns) == 1:
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table.name}"
+            ))
+
+
+def load(data_dir='generator', chunk_size=DEFAULT_CHUNK_SIZE, report=print):
+    """Drop and recreate the schema, then load the CSVs in `data_dir`."""
+
+    tables = db.Model.metadata.tables
+    derived = [tables[name] for name in DERIVED_TABLES]
+    loaded = [table for table in db.Model.metadata.sorted_tables
+              if table.name not in DERIVED_TABLES]
+
+    # Open transactions would block dropping their tables
+    db.session.remove()
+    db.drop_all()
+    start = perf_counter()
+
+    with db.engine.begin() as conn:
+        _create_bare_tables(conn)
+
+        for table_name, file_name in CSV_FILES:
+            path = os.path.join(data_dir, file_name)
+            if os.path.exists(path):
+                _load_table(conn, tables[table_name], path, chunk_size, report)
+
+        step = perf_counter()
+        _add_indexes_and_keys(conn, loaded)
+        search.create_search_indexes(conn)
+        report(f"indexes and foreign keys: {perf_counter() - step:.1f}s")
+
+    step = perf_counter()
+    counters.reconcile()
+    timeline.rebuild_timelines()
+    db.session.commit()
+    report(f"counters and timelines: {perf_counter() - step:.1f}s")
+
+    with db.engine.begin() as conn:
+        _add_indexes_and_keys(conn, derived)
+        _reset_sequences(conn)
+        if _is_postgres(conn):
+            conn.execute(text("ANALYZE"))
+
+    report(f"total: {perf_counter() - start:.1f}s")
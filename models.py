@@ -2,11 +2,22 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+import passwords
+import pooling
+from replicas import RoutingSQLAlchemy
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+
+class WarblerSQLAlchemy(RoutingSQLAlchemy):
+    """Flask-SQLAlchemy with replica routing and tunable connection pools."""
+
+    def create_engine(self, sa_url, engine_opts):
+        engine_opts = pooling.engine_options(self.get_app().config,
+                                             sa_url,
+                                             engine_opts)
+        return super().create_engine(sa_url, engine_opts)
+
+
+db = WarblerSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -26,6 +37,19 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', 'user_following_id'),
+    )
+
+    @classmethod
+    def exists(cls, followed_id, follower_id):
+        """Does `follower_id` follow `followed_id`?"""
+
+        query = cls.query.filter(cls.user_being_followed_id == followed_id,
+                                 cls.user_following_id == follower_id)
+
+        return db.session.query(query.exists()).scalar()
+
 
 class User(db.Model):
     """User in the system."""
@@ -72,6 +96,53 @@ class User(db.Model):
         nullable=False,
     )
 
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    fanout_on_read = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+    )
+
+    __table_args__ = (
+        db.Index('ix_users_username_lower', db.func.lower(username)),
+    )
+
     messages = db.relationship('Message', order_by='Message.timestamp.desc()')
 
     liked_messages = db.relationship('Message',
@@ -97,25 +168,65 @@ class User(db.Model):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
     def is_followed_by(self, other_user):
-        """Is this user followed by `other_user`?"""
+        """Is this user followed by `other_user`?
+
+        A single lookup on the `follows` primary key.
+        """
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(followed_id=self.id, follower_id=other_user.id)
 
     def is_following(self, other_user):
-        """Is this user following `other_user`?"""
+        """Is this user following `other_user`?
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        A single lookup on the `follows` primary key.
+        """
+
+        return Follows.exists(followed_id=other_user.id, follower_id=self.id)
+
+    def followed_ids(self, user_ids):
+        """Return the set of `user_ids` this user follows.
+
+        One query for a whole page of users, for list pages that show a
+        follow/unfollow button per user.
+        """
+
+        if not user_ids:
+            return set()
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(user_ids)))
+
+        return {user_id for (user_id,) in rows}
+
+    def liked_message_ids(self, message_ids):
+        """Return the set of `message_ids` this user has liked.
+
+        One query for a whole page of messages, instead of loading each
+        message's `liked_by` list.
+        """
+
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(LikedMessage.message_id)
+                .filter(LikedMessage.user_id == self.id,
+                        LikedMessage.message_id.in_(message_ids)))
+
+        return {message_id for (message_id,) in rows}
 
     @classmethod
     def signup(cls, username, email, password, image_url):
         """Sign up user.
 
         Hashes password and adds user to system.
+
+        Raises passwords.PasswordServiceBusy if the hashing pool is full.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -136,13 +247,19 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with a different bcrypt cost than the
+        configured one, it is replaced (the caller commits). Raises
+        passwords.PasswordServiceBusy if the hashing pool is full.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check_password(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash_password(password)
                 return user
 
         return False
@@ -177,6 +294,49 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a user's home timeline.
+
+    Rows are written when a message is posted (fan-out on write), so the
+    home page is a single range scan over (user_id, timestamp).
+    """
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+        index=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+    )
+
+
 class LikedMessage(db.Model):
     """Relationship between a liked message and user"""
 
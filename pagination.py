@@ -0,0 +1,144 @@
+"""Keyset (cursor) pagination for message and user listings.
+
+Messages are paged on (timestamp, id), newest first; users are paged on id.
+Each page is fetched with `WHERE key < cursor ORDER BY key LIMIT n + 1`,
+so every page costs the same however deep into a listing it is.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort, current_app, request, url_for
+from sqlalchemy import tuple_
+
+from models import Message, User
+
+MESSAGES_PER_PAGE = 100
+USERS_PER_PAGE = 60
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def messages_per_page():
+    return current_app.config.get('MESSAGES_PER_PAGE', MESSAGES_PER_PAGE)
+
+
+def users_per_page():
+    return current_app.config.get('USERS_PER_PAGE', USERS_PER_PAGE)
+
+
+def encode_cursor(*values):
+    """Make an opaque, URL-safe cursor from key values."""
+
+    raw = '|'.join(str(value) for value in values)
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, *converters):
+    """Return the key values of a cursor as a tuple, or None if no cursor.
+
+    Each value is parsed with the matching converter (e.g. int). Aborts
+    with a 400 if the cursor is malformed.
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = urlsafe_b64decode(padded.encode()).decode().split('|')
+        if len(values) != len(converters):
+            raise ValueError(cursor)
+        return tuple(convert(value)
+                     for convert, value in zip(converters, values))
+    except (ValueError, UnicodeDecodeError):
+        abort(400)
+
+
+def message_cursor(message):
+    return encode_cursor(message.timestamp.isoformat(), message.id)
+
+
+def user_cursor(user):
+    return encode_cursor(user.id)
+
+
+def decode_message_cursor(cursor):
+    """Return the (timestamp, id) key of a message cursor, or None.
+
+    Aborts with a 400 if the cursor is malformed.
+    """
+
+    return decode_cursor(cursor, datetime.fromisoformat, int)
+
+
+def decode_user_cursor(cursor):
+    """Return the id key of a user cursor, or None.
+
+    Aborts with a 400 if the cursor is malformed.
+    """
+
+    key = decode_cursor(cursor, int)
+    return key and key[0]
+
+
+def make_page(items, per_page, cursor_for):
+    """Build a Page from up to `per_page + 1` fetched items.
+
+    The extra item only signals that there is a next page; it is dropped.
+    """
+
+    if len(items) > per_page:
+        items = items[:per_page]
+        return Page(items, cursor_for(items[-1]))
+
+    return Page(items, None)
+
+
+def paginate_messages(query, cursor=None, per_page=None):
+    """Return a Page of `query`'s messages, newest first."""
+
+    per_page = per_page or messages_per_page()
+    key = decode_message_cursor(cursor)
+
+    if key:
+        query = query.filter(tuple_(Message.timestamp, Message.id) < key)
+
+    items = (query
+             .order_by(Message.timestamp.desc(), Message.id.desc())
+             .limit(per_page + 1)
+             .all())
+
+    return make_page(items, per_page, message_cursor)
+
+
+def paginate_users(query, cursor=None, per_page=None):
+    """Return a Page of `query`'s users, ordered by id."""
+
+    per_page = per_page or users_per_page()
+    key = decode_user_cursor(cursor)
+
+    if key:
+        query = query.filter(User.id > key)
+
+    items = (query
+             .order_by(User.id)
+             .limit(per_page + 1)
+             .all())
+
+    return make_page(items, per_page, user_cursor)
+
+
+def next_page_url(page):
+    """URL of the page after `page` for the current route, or None.
+
+    Keeps the current query string (e.g. a search term).
+    """
+
+    if not page.next_cursor:
+        return None
+
+    args = request.args.to_dict()
+    args['cursor'] = page.next_cursor
+    return url_for(request.endpoint, **request.view_args, **args)
@@ -0,0 +1,113 @@
+"""Password hashing for Warbler, off the request worker.
+
+bcrypt is deliberately slow, so hashing and checking run in a small
+process pool (BCRYPT_POOL_SIZE processes per app worker) instead of inline.
+At most BCRYPT_MAX_PENDING calls may wait for the pool; beyond that
+PasswordServiceBusy is raised straight away, so a burst of logins is shed
+instead of tying up every worker.
+
+The work factor is BCRYPT_LOG_ROUNDS. Hashes made with a different cost
+are upgraded the next time their owner logs in (see `needs_rehash`).
+Set BCRYPT_POOL_SIZE to 0 to hash inline (e.g. in a shell).
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+from flask import current_app, has_app_context
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_POOL_SIZE = 2
+DEFAULT_MAX_PENDING = 16
+DEFAULT_TIMEOUT = 10
+
+_pool = None
+_pool_pid = None
+_slots = None
+_pool_lock = Lock()
+
+
+class PasswordServiceBusy(Exception):
+    """Too many password hashes are already queued; try again later."""
+
+
+def _config(name, default):
+    if not has_app_context():
+        return default
+
+    return current_app.config.get(name, default)
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def _get_pool():
+    """Return this process's pool, creating it after startup or a fork."""
+
+    global _pool, _pool_pid, _slots
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            size = _config('BCRYPT_POOL_SIZE', DEFAULT_POOL_SIZE)
+            _pool = ProcessPoolExecutor(max_workers=size)
+            _pool_pid = os.getpid()
+            _slots = BoundedSemaphore(
+                size + _config('BCRYPT_MAX_PENDING', DEFAULT_MAX_PENDING))
+
+        return _pool, _slots
+
+
+def _run(fn, *args):
+    """Run `fn(*args)` in the pool and wait for the result."""
+
+    if not _config('BCRYPT_POOL_SIZE', DEFAULT_POOL_SIZE):
+        return fn(*args)
+
+    pool, slots = _get_pool()
+
+    if not slots.acquire(blocking=False):
+        raise PasswordServiceBusy()
+
+    try:
+        future = pool.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+
+    future.add_done_callback(lambda _: slots.release())
+    return future.result(timeout=_config('BCRYPT_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def log_rounds():
+    return _config('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS)
+
+
+def hash_password(password):
+    """Return the bcrypt hash of `password` at the configured cost."""
+
+    return _run(_hash, password, log_rounds())
+
+
+def check_password(hashed, password):
+    """Does `password` match the bcrypt hash `hashed`?"""
+
+    return _run(_check, hashed, password)
+
+
+def needs_rehash(hashed):
+    """Was `hashed` made with a different cost than the configured one?"""
+
+    try:
+        rounds = int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+
+    return rounds != log_rounds()
@@ -0,0 +1,179 @@
+"""Database connection pool tuning and metrics for Warbler.
+
+Pool settings for PostgreSQL engines come from config (set from the
+environment in app.py):
+
+- DB_POOL_SIZE, DB_MAX_OVERFLOW: connections kept open / allowed on top
+- DB_POOL_TIMEOUT: seconds to wait for a free connection
+- DB_POOL_RECYCLE: seconds after which a connection is replaced
+- DB_POOL_PRE_PING: test connections on checkout, dropping stale ones
+- DB_STATEMENT_TIMEOUT: per-statement limit in milliseconds
+
+DB_POOLER_MODE = 'transaction' is for running behind a transaction pooler
+such as PgBouncer. Connections are then not pooled here (NullPool), no
+startup options are sent, and the statement timeout is applied with
+SET LOCAL when each transaction begins (ORM sessions always begin one),
+so no state outlives a transaction on the server connection. (psycopg2 doesn't use server-side prepared statements.)
+
+In the default mode the pool is an InstrumentedQueuePool, which records
+checkout latency, current waiters, overflow and timeouts; see
+`pool_stats()`.
+"""
+
+from threading import Lock
+from time import perf_counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+TRANSACTION_MODE = 'transaction'
+STATEMENT_TIMEOUT_OPTION = 'warbler_statement_timeout'
+
+# Upper bounds (seconds) of the cumulative checkout latency histogram
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class PoolStats:
+    """Counters for one pool, safe to update from several threads."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.waiters = 0
+        self.max_waiters = 0
+        self.timeouts = 0
+        self.overflow_checkouts = 0
+
+    def start_wait(self):
+        with self._lock:
+            self.waiters += 1
+            self.max_waiters = max(self.max_waiters, self.waiters)
+
+    def end_wait(self, seconds, overflowed, timed_out):
+        with self._lock:
+            self.waiters -= 1
+
+            if timed_out:
+                self.timeouts += 1
+                return
+
+            self.checkouts += 1
+            self.checkout_seconds += seconds
+            self.max_checkout_seconds = max(self.max_checkout_seconds, seconds)
+            self.overflow_checkouts += overflowed
+
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    self.latency_buckets[i] += 1
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long each checkout waits for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        self.stats.start_wait()
+        start = perf_counter()
+        timed_out = False
+
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.stats.end_wait(perf_counter() - start,
+                                overflowed=int(self.overflow() > 0),
+                                timed_out=timed_out)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def engine_options(config, sa_url, options):
+    """Return `options` with the configured pool settings for `sa_url`.
+
+    Only PostgreSQL engines are tuned; others keep their defaults.
+    """
+
+    if not sa_url.drivername.startswith('postgresql'):
+        return options
+
+    options = dict(options)
+    statement_timeout = config.get('DB_STATEMENT_TIMEOUT')
+
+    if config.get('DB_POOLER_MODE') == TRANSACTION_MODE:
+        options['poolclass'] = NullPool
+        for name in ('pool_size', 'max_overflow', 'pool_timeout'):
+            options.pop(name, None)
+        if statement_timeout:
+            options.setdefault('execution_options', {})[
+                STATEMENT_TIMEOUT_OPTION] = int(statement_timeout)
+        return options
+
+    options['poolclass'] = InstrumentedQueuePool
+
+    for option, name in (('pool_size', 'DB_POOL_SIZE'),
+                         ('max_overflow', 'DB_MAX_OVERFLOW'),
+                         ('pool_timeout', 'DB_POOL_TIMEOUT'),
+                         ('pool_recycle', 'DB_POOL_RECYCLE'),
+                         ('pool_pre_ping', 'DB_POOL_PRE_PING')):
+        if config.get(name) is not None:
+            options[option] = config[name]
+
+    if statement_timeout:
+        connect_args = options.setdefault('connect_args', {})
+        connect_args['options'] = (
+            f"{connect_args.get('options', '')} "
+            f"-c statement_timeout={int(statement_timeout)}").strip()
+
+    return options
+
+
+@event.listens_for(Engine, 'begin')
+def _set_local_statement_timeout(conn):
+    """Apply the statement timeout per transaction in transaction mode."""
+
+    timeout = conn.get_execution_options().get(STATEMENT_TIMEOUT_OPTION)
+
+    if timeout:
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+
+def pool_stats(engine):
+    """Return a dict describing `engine`'s pool and its checkout metrics."""
+
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__, 'url': repr(engine.url)}
+
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(),
+                     checked_out=pool.checkedout(),
+                     checked_in=pool.checkedin(),
+                     overflow=max(pool.overflow(), 0))
+
+    if isinstance(pool, InstrumentedQueuePool):
+        metrics = pool.stats
+        stats.update(
+            checkouts=metrics.checkouts,
+            checkout_seconds_total=metrics.checkout_seconds,
+            checkout_seconds_max=metrics.max_checkout_seconds,
+            checkout_latency_buckets=dict(zip(LATENCY_BUCKETS,
+                                              metrics.latency_buckets)),
+            waiters=metrics.waiters,
+            max_waiters=metrics.max_waiters,
+            timeouts=metrics.timeouts,
+            overflow_checkouts=metrics.overflow_checkouts,
+        )
+
+    return stats
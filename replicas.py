@@ -0,0 +1,98 @@
+"""Read-replica routing for Warbler.
+
+When DATABASE_REPLICA_URLS is set (comma separated), each replica becomes
+a Flask-SQLAlchemy bind named replica_<n>, and GET/HEAD requests read from
+one replica picked at random for the whole request. Everything else goes
+to the primary: non-GET requests, flushes and INSERT/UPDATE/DELETE
+statements, and code running outside a request (CLI commands, tests).
+
+Read-your-writes: after a browser makes a POST (signing up, posting,
+liking, following...), its requests read from the primary for the next
+READ_YOUR_WRITES_SECONDS, so a user never sees a replica that hasn't
+caught up with their own change.
+"""
+
+import random
+from time import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.sql import Delete, Insert, Update
+
+REPLICA_BIND_PREFIX = 'replica_'
+PRIMARY_UNTIL_KEY = 'primary_until'
+DEFAULT_READ_YOUR_WRITES_SECONDS = 5
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends a request's reads to its chosen replica."""
+
+    def __init__(self, db, *args, **kwargs):
+        self.db = db
+        super().__init__(db, *args, **kwargs)
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = _request_replica()
+
+        if (replica is None
+                or self._flushing
+                or isinstance(clause, (Insert, Update, Delete))):
+            return super().get_bind(mapper, clause)
+
+        return self.db.get_engine(self.app, bind=replica)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose sessions are RoutingSessions."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def configure(app, urls):
+    """Register `urls` as replica binds of `app`."""
+
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {}) or {}
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    names = []
+    for i, url in enumerate(urls):
+        name = f"{REPLICA_BIND_PREFIX}{i}"
+        binds[name] = url
+        names.append(name)
+
+    app.config['SQLALCHEMY_REPLICA_BINDS'] = names
+
+
+def _request_replica():
+    if not has_request_context():
+        return None
+
+    return g.get('replica_bind')
+
+
+def init_app(app):
+    """Choose a replica per request and track read-your-writes windows."""
+
+    @app.before_request
+    def choose_replica():
+        names = app.config.get('SQLALCHEMY_REPLICA_BINDS')
+
+        if (names
+                and request.method in READ_METHODS
+                and session.get(PRIMARY_UNTIL_KEY, 0) < time()):
+            g.replica_bind = random.choice(names)
+        else:
+            g.replica_bind = None
+
+    @app.after_request
+    def remember_write(response):
+        if (app.config.get('SQLALCHEMY_REPLICA_BINDS')
+                and request.method not in READ_METHODS):
+            session[PRIMARY_UNTIL_KEY] = time() + app.config.get(
+                'READ_YOUR_WRITES_SECONDS', DEFAULT_READ_YOUR_WRITES_SECONDS)
+
+        return response
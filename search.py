@@ -0,0 +1,149 @@
+"""Username search for Warbler.
+
+Searches use an index on lower(username):
+
+- prefix matches are a range scan on the B-tree expression index, which
+  works on every database (including SQLite for local testing)
+- on PostgreSQL with the pg_trgm extension, substring matches use a GIN
+  trigram index on lower(username)
+
+Results are ranked exact match, then prefix, then substring, and paged on
+(rank, id) with the same cursors as the rest of the listings.
+"""
+
+from flask import current_app
+from sqlalchemy import case, event, func, text, tuple_
+
+from models import db, User
+from pagination import decode_cursor, encode_cursor, make_page, users_per_page
+
+AUTOCOMPLETE_LIMIT = 10
+
+# pg_trgm can't use its index for terms shorter than a trigram
+MIN_SUBSTRING_LENGTH = 3
+
+_trigram_enabled = {}
+
+
+def create_search_indexes(connection):
+    """Create the username search indexes. Idempotent.
+
+    The trigram index is only created on PostgreSQL with pg_trgm available.
+    """
+
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_username_lower "
+        "ON users (lower(username))"
+    ))
+
+    if connection.dialect.name != 'postgresql':
+        return
+
+    available = connection.execute(text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).scalar()
+
+    if not available:
+        return
+
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+        "ON users USING gin (lower(username) gin_trgm_ops)"
+    ))
+
+
+@event.listens_for(User.__table__, 'after_create')
+def _create_search_indexes_after_users(target, connection, **kw):
+    create_search_indexes(connection)
+
+
+def trigram_enabled():
+    """Is substring search backed by a trigram index on this database?"""
+
+    engine = db.get_engine()
+
+    if engine.url not in _trigram_enabled:
+        enabled = False
+        if engine.dialect.name == 'postgresql':
+            with engine.connect() as connection:
+                enabled = bool(connection.execute(text(
+                    "SELECT 1 FROM pg_indexes "
+                    "WHERE indexname = 'ix_users_username_trgm'"
+                )).scalar())
+        _trigram_enabled[engine.url] = enabled
+
+    return _trigram_enabled[engine.url]
+
+
+def _normalize(term):
+    return (term or '').strip().lower()
+
+
+def _prefix_filter(term):
+    """Match usernames starting with `term` (which must not be empty).
+
+    The range bounds let the B-tree index narrow the scan; the LIKE
+    rechecks the prefix exactly.
+    """
+
+    username = func.lower(User.username)
+    upper_bound = term[:-1] + chr(ord(term[-1]) + 1)
+
+    return db.and_(username >= term,
+                   username < upper_bound,
+                   username.startswith(term, autoescape=True))
+
+
+def search_users(term, cursor=None, per_page=None):
+    """Return a Page of users whose username matches `term`, best first."""
+
+    per_page = per_page or users_per_page()
+    term = _normalize(term)
+    username = func.lower(User.username)
+
+    if not term:
+        return make_page([], per_page, None)
+
+    if len(term) >= MIN_SUBSTRING_LENGTH and trigram_enabled():
+        match = username.contains(term, autoescape=True)
+    else:
+        match = _prefix_filter(term)
+
+    rank = case(
+        (username == term, 0),
+        (username.startswith(term, autoescape=True), 1),
+        else_=2,
+    )
+
+    query = db.session.query(User, rank).filter(match)
+
+    key = decode_cursor(cursor, int, int)
+    if key:
+        query = query.filter(tuple_(rank, User.id) > key)
+
+    rows = query.order_by(rank, User.id).limit(per_page + 1).all()
+
+    page = make_page(rows, per_page,
+                     lambda row: encode_cursor(row[1], row[0].id))
+
+    return page._replace(items=[user for user, _ in page.items])
+
+
+def autocomplete(term, limit=None):
+    """Return up to `limit` (id, username, image_url) rows whose username
+    starts with `term`, for typeahead."""
+
+    limit = limit or current_app.config.get('AUTOCOMPLETE_LIMIT',
+                                            AUTOCOMPLETE_LIMIT)
+    term = _normalize(term)
+
+    if not term:
+        return []
+
+    return (db.session
+            .query(User.id, User.username, User.image_url)
+            .filter(_prefix_filter(term))
+            .order_by(func.lower(User.username))
+            .limit(limit)
+            .all())
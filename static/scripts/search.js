@@ -0,0 +1,34 @@
+"use strict";
+
+// Suggest usernames in the search box as the user types.
+
+const AUTOCOMPLETE_URL = "/users/autocomplete";
+
+$(function () {
+  const $search = $("#search");
+  const $suggestions = $("#search-suggestions");
+  let latestTerm = "";
+
+  $search.on("input", async function () {
+    const term = $search.val().trim();
+    latestTerm = term;
+
+    if (!term) {
+      $suggestions.empty();
+      return;
+    }
+
+    const resp = await fetch(
+      `${AUTOCOMPLETE_URL}?q=${encodeURIComponent(term)}`
+    );
+    const { users } = await resp.json();
+
+    // Ignore responses that arrive after the user kept typing
+    if (term !== latestTerm) return;
+
+    $suggestions.empty();
+    for (const user of users) {
+      $suggestions.append($("<option>").val(user.username));
+    }
+  });
+});
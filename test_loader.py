@@ -0,0 +1,90 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app
+import loader
+
+db.create_all()
+
+USERS_CSV = """email,username,image_url,password,bio,header_image_url,location
+a@test.com,alice,/a.png,hashed,,/h.png,Here
+b@test.com,bob,/b.png,hashed,"Hi, I'm bob",/h.png,There
+"""
+
+MESSAGES_CSV = """text,timestamp,user_id
+first,2017-01-21 11:04:53.522807,1
+second,2017-01-22 11:04:53.522807,1
+"""
+
+FOLLOWS_CSV = """user_being_followed_id,user_following_id
+1,2
+"""
+
+
+class LoaderTestCase(TestCase):
+    """Test loading CSV files into a fresh schema."""
+
+    def load(self, chunk_size):
+        with TemporaryDirectory() as data_dir:
+            for name, contents in (('users.csv', USERS_CSV),
+                                   ('messages.csv', MESSAGES_CSV),
+                                   ('follows.csv', FOLLOWS_CSV)):
+                with open(os.path.join(data_dir, name), 'w') as csv_file:
+                    csv_file.write(contents)
+
+            report = []
+            with app.app_context():
+                loader.load(data_dir, chunk_size, report=report.append)
+
+        return report
+
+    def test_load(self):
+        report = self.load(chunk_size=1)
+
+        self.assertTrue(report[0].startswith('users: 2 rows'))
+
+        alice = User.query.filter_by(username='alice').one()
+        bob = User.query.filter_by(username='bob').one()
+        self.assertEqual(bob.bio, "Hi, I'm bob")
+        self.assertEqual(alice.messages_count, 2)
+        self.assertEqual(alice.followers_count, 1)
+        self.assertEqual(bob.following_count, 1)
+        self.assertEqual(
+            [m.text for m in Message.query.order_by(Message.id)],
+            ['first', 'second'])
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=bob.id).count(), 2)
+
+    def test_indexes_and_sequences(self):
+        self.load(chunk_size=1000)
+
+        index_names = {index['name']
+                       for index in inspect(db.engine).get_indexes('messages')}
+        self.assertIn('ix_messages_user_id_timestamp', index_names)
+
+        # New rows get ids past the loaded ones
+        user = User.signup('carol', 'c@test.com', 'password', None)
+        db.session.commit()
+        self.assertEqual(user.id, 3)
@@ -150,3 +150,20 @@ class MessageModelTestCase(TestCase):
 
         self.assertEqual(len(self.test_1.messages), 0)
         self.assertIsNone(Message.query.get(self.test_msg.id))
+
+    def test_liked_message_ids(self):
+        """Does liked_message_ids return only the liked messages among
+        those asked about?"""
+
+        unliked_msg = Message(text="Not liked", user_id=self.test_1.id)
+        db.session.add(unliked_msg)
+        db.session.commit()
+
+        db.session.add(LikedMessage(user_id=self.test_1.id,
+                                    message_id=self.test_msg.id))
+        db.session.commit()
+
+        self.assertEqual(
+            self.test_1.liked_message_ids([self.test_msg.id, unliked_msg.id]),
+            {self.test_msg.id})
+        self.assertEqual(self.test_1.liked_message_ids([]), set())
@@ -6,9 +6,11 @@
 
 
 import os
+from contextlib import contextmanager
 from unittest import TestCase
+from sqlalchemy import event
 from sqlalchemy.exc import NoResultFound
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Follows, LikedMessage
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,6 +22,8 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+import fragments
+import timeline
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -32,6 +36,21 @@ db.create_all()
 app.config['WTF_CSRF_ENABLED'] = False
 
 
+@contextmanager
+def count_statements(statements):
+    """Append each SQL statement run inside the block to `statements`."""
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.get_engine()
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
 class MessageViewTestCase(TestCase):
     """Test views for messages."""
 
@@ -181,4 +200,171 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
 
             self.assertIn('Access unauthorized.', html)                 
-           
\ No newline at end of file
+           
+    def test_add_message_fans_out_to_followers(self):
+        """Does a new message land in each follower's home timeline?"""
+
+        follower = User.signup(username="follower",
+                               email="follower@test.com",
+                               password="follower",
+                               image_url=None)
+        db.session.commit()
+        follower_id = follower.id
+
+        db.session.add(Follows(user_being_followed_id=self.test_user_id,
+                               user_following_id=follower_id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id
+
+            c.post("/messages/new", data={"text": "Fanned out"})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = follower_id
+
+            resp = c.get("/")
+            self.assertIn("Fanned out", resp.get_data(as_text=True))
+
+    def test_show_liked_message(self):
+        """Does a message the current user liked render an unlike button?"""
+
+        liker = User.signup(username="liker",
+                            email="liker@test.com",
+                            password="liker",
+                            image_url=None)
+        db.session.commit()
+        liker_id = liker.id
+
+        db.session.add(LikedMessage(user_id=liker_id,
+                                    message_id=self.test_msg_id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = liker_id
+
+            resp = c.get(f"/messages/{self.test_msg_id}")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f"/messages/{self.test_msg_id}/unlike", html)
+
+    def test_message_counters(self):
+        """Do posting, liking and deleting keep counters in step?"""
+
+        liker = User.signup(username="liker",
+                            email="liker@test.com",
+                            password="liker",
+                            image_url=None)
+        db.session.commit()
+        liker_id = liker.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id
+
+            c.post("/messages/new", data={"text": "Counted"})
+            msg = Message.query.filter_by(text="Counted").one()
+
+            self.assertEqual(User.query.get(self.test_user_id).messages_count, 1)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = liker_id
+
+            c.post(f"/messages/{msg.id}/like")
+            self.assertEqual(User.query.get(liker_id).likes_count, 1)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id
+
+            c.post(f"/messages/{msg.id}/delete")
+
+            self.assertEqual(User.query.get(self.test_user_id).messages_count, 0)
+            self.assertEqual(User.query.get(liker_id).likes_count, 0)
+
+    def _feed_statements(self, num_authors):
+        """Statements run to render the home feed of a user following
+        `num_authors` authors with one message each."""
+
+        reader = User.query.get(self.test_user_id)
+
+        for i in range(num_authors):
+            author = User.signup(username=f"author{i}",
+                                 email=f"author{i}@test.com",
+                                 password="password",
+                                 image_url=None)
+            db.session.commit()
+            reader.following.append(author)
+            db.session.add(Message(text=f"Warble {i}", user_id=author.id))
+            db.session.commit()
+
+        with app.app_context():
+            timeline.rebuild_timelines()
+            db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id
+
+            # Warm up per-worker caches so only the feed itself is counted
+            c.get("/")
+
+            with count_statements([]) as statements:
+                resp = c.get("/")
+
+            self.assertEqual(resp.status_code, 200)
+            return len(statements)
+
+    def test_feed_statement_count_is_fixed(self):
+        """Does rendering the feed take the same number of statements no
+        matter how many authors it shows?"""
+
+        few = self._feed_statements(1)
+
+        User.query.filter(User.username.like("author%")).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+        many = self._feed_statements(5)
+
+        self.assertEqual(few, many)
+
+    def test_message_fragment_cached(self):
+        """Is a message's list item rendered once and reused, while a
+        change to its author's profile renders it afresh?"""
+
+        with self.client as c:
+            resp = c.get(f"/users/{self.test_user_id}")
+            self.assertIn("Hello World!", resp.get_data(as_text=True))
+
+            # Messages never change, so a changed row proves a cache hit
+            Message.query.filter_by(id=self.test_msg_id).update(
+                {"text": "Changed behind the cache"})
+            db.session.commit()
+
+            resp = c.get(f"/users/{self.test_user_id}")
+            self.assertIn("Hello World!", resp.get_data(as_text=True))
+
+            User.query.filter_by(id=self.test_user_id).update(
+                {"username": "renamed"})
+            db.session.commit()
+
+            resp = c.get(f"/users/{self.test_user_id}")
+            html = resp.get_data(as_text=True)
+            self.assertIn("Changed behind the cache", html)
+            self.assertIn("@renamed", html)
+
+    def test_fragment_lru_bounded(self):
+        """Does the LRU backend evict the least recently used entry?"""
+
+        backend = fragments.LRUBackend(max_entries=2)
+        backend.set("a", "A")
+        backend.set("b", "B")
+        backend.get("a")
+        backend.set("c", "C")
+
+        self.assertEqual(backend.get("a"), "A")
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("c"), "C")
@@ -0,0 +1,89 @@
+"""Connection pool tuning and metrics tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_pooling.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app
+import pooling
+
+db.create_all()
+
+
+class PoolingTestCase(TestCase):
+    """Test pool options and the pool metrics endpoint."""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.url = make_url(os.environ['DATABASE_URL'])
+
+    def tearDown(self):
+        app.config['ADMIN_TOKEN'] = None
+
+    def test_statement_timeout(self):
+        """Is the statement timeout set on pooled connections?"""
+
+        engine = create_engine(self.url, **pooling.engine_options(
+            {'DB_STATEMENT_TIMEOUT': 2500, 'DB_POOL_SIZE': 2}, self.url, {}))
+
+        with engine.connect() as conn:
+            timeout = conn.execute(text("SHOW statement_timeout")).scalar()
+
+        self.assertEqual(timeout, "2500ms")
+        self.assertEqual(engine.pool.size(), 2)
+        self.assertEqual(engine.pool.stats.checkouts, 1)
+        engine.dispose()
+
+    def test_transaction_pooler_mode(self):
+        """In transaction mode, is nothing pooled here, and is the timeout
+        scoped to each transaction?"""
+
+        engine = create_engine(self.url, **pooling.engine_options(
+            {'DB_STATEMENT_TIMEOUT': 1234, 'DB_POOLER_MODE': 'transaction'},
+            self.url, {}))
+
+        with engine.begin() as conn:
+            in_transaction = conn.execute(
+                text("SHOW statement_timeout")).scalar()
+
+        self.assertEqual(in_transaction, "1234ms")
+        self.assertEqual(pooling.pool_stats(engine)['pool'], 'NullPool')
+        engine.dispose()
+
+    def test_pool_stats_endpoint(self):
+        """Is /admin/pool hidden without a token, forbidden with a wrong
+        one, and a JSON report with the right one?"""
+
+        with self.client as c:
+            self.assertEqual(c.get('/admin/pool').status_code, 404)
+
+            app.config['ADMIN_TOKEN'] = 'sekrit'
+
+            resp = c.get('/admin/pool',
+                         headers={'Authorization': 'Bearer wrong'})
+            self.assertEqual(resp.status_code, 403)
+
+            resp = c.get('/admin/pool',
+                         headers={'Authorization': 'Bearer sekrit'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['primary']['pool'],
+                             'InstrumentedQueuePool')
+            self.assertIn('waiters', resp.json['primary'])
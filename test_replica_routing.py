@@ -0,0 +1,119 @@
+"""Read-replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_replica_routing.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import replicas
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test that reads go to a replica, and writes and recent writers to
+    the primary. The "replica" is a SQLite file holding different data, so
+    we can tell which database answered."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        replica_url = f"sqlite:///{cls.replica_dir.name}/replica.db"
+
+        cls.saved_binds = app.config.get('SQLALCHEMY_BINDS')
+        replicas.configure(app, [replica_url])
+
+        cls.replica = db.get_engine(app, bind='replica_0')
+        db.Model.metadata.create_all(cls.replica)
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config['SQLALCHEMY_BINDS'] = cls.saved_binds
+        app.config['SQLALCHEMY_REPLICA_BINDS'] = []
+        cls.replica.dispose()
+        cls.replica_dir.cleanup()
+
+    def setUp(self):
+        """Create the same user id with different usernames on the primary
+        and the replica."""
+
+        User.query.delete()
+        Message.query.delete()
+
+        user = User.signup(username="onprimary",
+                           email="primary@test.com",
+                           password="password",
+                           image_url=None)
+        db.session.commit()
+        self.user_id = user.id
+
+        with self.replica.begin() as conn:
+            conn.execute(User.__table__.delete())
+            conn.execute(User.__table__.insert().values(
+                id=self.user_id,
+                username="onreplica",
+                email="replica@test.com",
+                password=user.password,
+            ))
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_reads_go_to_replica(self):
+        """Does a logged-out GET read from the replica?"""
+
+        with self.client as c:
+            resp = c.get(f'/users/{self.user_id}')
+
+            self.assertIn("@onreplica", resp.get_data(as_text=True))
+
+    def test_writes_go_to_primary(self):
+        """Do POSTs write to the primary, and does the writer read their
+        own write from the primary afterwards?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.post('/messages/new', data={"text": "Written to primary"})
+
+            self.assertEqual(
+                Message.query.filter_by(user_id=self.user_id).count(), 1)
+
+            resp = c.get(f'/users/{self.user_id}')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("@onprimary", html)
+            self.assertIn("Written to primary", html)
+
+    def test_read_your_writes_window_expires(self):
+        """Once the read-your-writes window has passed, do reads go back
+        to the replica?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[replicas.PRIMARY_UNTIL_KEY] = 0
+
+            resp = c.get(f'/users/{self.user_id}')
+
+            self.assertIn("@onreplica", resp.get_data(as_text=True))
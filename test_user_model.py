@@ -21,6 +21,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app
+import passwords
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -150,3 +151,55 @@ class UserModelTestCase(TestCase):
         #wrong username, right password
         self.assertEqual(User.authenticate("notAuthenTest", "mypassw"), False)
 
+
+    def test_followed_ids(self):
+        """Does followed_ids return only the followed users among those
+        asked about?"""
+
+        follow_rlshp = Follows(
+            user_being_followed_id=self.test_2.id,
+            user_following_id=self.test_1.id)
+
+        db.session.add(follow_rlshp)
+        db.session.commit()
+
+        self.assertEqual(
+            self.test_1.followed_ids([self.test_1.id, self.test_2.id]),
+            {self.test_2.id})
+        self.assertEqual(self.test_2.followed_ids([self.test_1.id]), set())
+        self.assertEqual(self.test_1.followed_ids([]), set())
+
+    def test_authenticate_upgrades_hash_cost(self):
+        """Does a successful login re-hash a password made with a different
+        bcrypt cost than the configured one?"""
+
+        user = User.signup("rehashTest", "rehash@gmail.com", "mypassw", "")
+        db.session.commit()
+        self.assertIn("$12$", user.password)
+
+        with app.app_context():
+            app.config['BCRYPT_LOG_ROUNDS'] = 4
+            try:
+                authed = User.authenticate("rehashTest", "mypassw")
+                self.assertEqual(authed, user)
+                self.assertIn("$04$", authed.password)
+                self.assertTrue(passwords.check_password(authed.password,
+                                                         "mypassw"))
+            finally:
+                app.config['BCRYPT_LOG_ROUNDS'] = passwords.DEFAULT_LOG_ROUNDS
+
+    def test_password_pool_sheds_load(self):
+        """Is PasswordServiceBusy raised when the hashing queue is full?"""
+
+        with app.app_context():
+            pool, slots = passwords._get_pool()
+            taken = 0
+            while slots.acquire(blocking=False):
+                taken += 1
+
+            try:
+                self.assertRaises(passwords.PasswordServiceBusy,
+                                  passwords.hash_password, "mypassw")
+            finally:
+                for _ in range(taken):
+                    slots.release()
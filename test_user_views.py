@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 from sqlalchemy.exc import NoResultFound
-from models import db, connect_db, Message, User, Follows
+from models import db, connect_db, Message, User, Follows, TimelineEntry
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,6 +20,8 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+import counters
+import identity
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -88,3 +90,287 @@ class UserViewTestCase(TestCase):
 
             self.assertEqual(resp.status_code, 200)
             self.assertIn(testuser1.username, html)
+
+    def test_follow_backfills_home_timeline(self):
+        """After following a user, do their messages show on the home page?"""
+
+        msg = Message(text="Backfilled warble", user_id=self.test_user_id2)
+        db.session.add(msg)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id1
+
+            resp = c.get('/')
+            self.assertNotIn("Backfilled warble", resp.get_data(as_text=True))
+
+            c.post(f'/users/follow/{self.test_user_id2}')
+
+            resp = c.get('/')
+            self.assertIn("Backfilled warble", resp.get_data(as_text=True))
+
+    def test_unfollow_prunes_home_timeline(self):
+        """After unfollowing a user, are their messages gone from home?"""
+
+        msg = Message(text="Pruned warble", user_id=self.test_user_id2)
+        db.session.add(msg)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id1
+
+            c.post(f'/users/follow/{self.test_user_id2}')
+            c.post(f'/users/stop-following/{self.test_user_id2}')
+
+            resp = c.get('/')
+            self.assertNotIn("Pruned warble", resp.get_data(as_text=True))
+
+    def test_popular_user_merged_at_read(self):
+        """Are messages from accounts past the fan-out limit merged into
+        followers' home pages at read time?"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 0
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.test_user_id1
+
+                c.post(f'/users/follow/{self.test_user_id2}')
+
+                popular = User.query.get(self.test_user_id2)
+                self.assertTrue(popular.fanout_on_read)
+
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.test_user_id2
+
+                c.post('/messages/new', data={"text": "Read-time warble"})
+
+                self.assertEqual(
+                    TimelineEntry.query
+                    .filter_by(user_id=self.test_user_id1)
+                    .count(), 0)
+
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.test_user_id1
+
+                resp = c.get('/')
+                self.assertIn("Read-time warble", resp.get_data(as_text=True))
+        finally:
+            app.config['TIMELINE_FANOUT_LIMIT'] = 10000
+
+    def test_profile_messages_paginated(self):
+        """Does the profile page show one page of messages and link to the
+        next, older page?"""
+
+        for i in range(3):
+            db.session.add(Message(text=f"Paged warble {i}",
+                                   user_id=self.test_user_id1))
+        db.session.commit()
+
+        app.config['MESSAGES_PER_PAGE'] = 2
+
+        try:
+            with self.client as c:
+                resp = c.get(f'/users/{self.test_user_id1}')
+                html = resp.get_data(as_text=True)
+
+                self.assertEqual(html.count("Paged warble"), 2)
+                self.assertIn("Older", html)
+
+                cursor = html.split('?cursor=')[1].split('"')[0]
+                resp = c.get(f'/users/{self.test_user_id1}?cursor={cursor}')
+                html = resp.get_data(as_text=True)
+
+                self.assertEqual(html.count("Paged warble"), 1)
+                self.assertNotIn("Older", html)
+        finally:
+            del app.config['MESSAGES_PER_PAGE']
+
+    def test_bad_cursor(self):
+        """Does a malformed cursor get a 400?"""
+
+        with self.client as c:
+            resp = c.get(f'/users/{self.test_user_id1}?cursor=not-a-cursor')
+
+            self.assertEqual(resp.status_code, 400)
+
+    def test_follow_counters(self):
+        """Do following/unfollowing keep both users' counters in step?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id1
+
+            c.post(f'/users/follow/{self.test_user_id2}')
+
+            follower = User.query.get(self.test_user_id1)
+            followed = User.query.get(self.test_user_id2)
+            self.assertEqual(follower.following_count, 1)
+            self.assertEqual(followed.followers_count, 1)
+
+            c.post(f'/users/stop-following/{self.test_user_id2}')
+
+            follower = User.query.get(self.test_user_id1)
+            followed = User.query.get(self.test_user_id2)
+            self.assertEqual(follower.following_count, 0)
+            self.assertEqual(followed.followers_count, 0)
+
+    def test_reconcile_counts(self):
+        """Does reconcile rebuild counters from the underlying tables?"""
+
+        db.session.add(Follows(user_being_followed_id=self.test_user_id1,
+                               user_following_id=self.test_user_id2))
+        db.session.add(Message(text="Counted", user_id=self.test_user_id1))
+        db.session.commit()
+
+        counters.reconcile()
+        db.session.commit()
+
+        user1 = User.query.get(self.test_user_id1)
+        user2 = User.query.get(self.test_user_id2)
+        self.assertEqual(user1.messages_count, 1)
+        self.assertEqual(user1.followers_count, 1)
+        self.assertEqual(user2.following_count, 1)
+        self.assertEqual(user2.messages_count, 0)
+
+    def test_delete_user_counters(self):
+        """Does deleting an account decrement its followers' following
+        counts and its likers' like counts?"""
+
+        msg = Message(text="Soon gone", user_id=self.test_user_id1)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id2
+
+            c.post(f'/users/follow/{self.test_user_id1}')
+            c.post(f'/messages/{msg_id}/like')
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id1
+
+            c.post('/users/delete')
+
+            survivor = User.query.get(self.test_user_id2)
+            self.assertIsNone(User.query.get(self.test_user_id1))
+            self.assertEqual(survivor.following_count, 0)
+            self.assertEqual(survivor.likes_count, 0)
+
+    def test_search_ranks_exact_match_first(self):
+        """Does search put an exact username match ahead of prefix matches?"""
+
+        with self.client as c:
+            resp = c.get('/users?q=TESTUSER')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertLess(html.index('@testuser<'), html.index('@testuser2<'))
+
+            resp = c.get('/users?q=nobody')
+            self.assertIn("Sorry, no users found", resp.get_data(as_text=True))
+
+    def test_autocomplete(self):
+        """Does autocomplete return JSON of usernames with that prefix?"""
+
+        with self.client as c:
+            resp = c.get('/users/autocomplete?q=testuser2')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(
+                [user['username'] for user in resp.json['users']],
+                ['testuser2'])
+
+            resp = c.get('/users/autocomplete?q=')
+            self.assertEqual(resp.json['users'], [])
+
+    def test_identity_cached(self):
+        """Is the logged-in user's summary served from the cache after the
+        first lookup, without loading the row?"""
+
+        with app.app_context():
+            identity.invalidate(self.test_user_id1)
+
+            first = identity.current_user(self.test_user_id1)
+            second = identity.current_user(self.test_user_id1)
+
+            self.assertIsNotNone(first._user)
+            self.assertIsNone(second._user)
+            self.assertEqual(second.username, "testuser")
+            self.assertIsNone(identity.current_user(-1))
+
+    def test_edit_profile_invalidates_identity(self):
+        """After a profile edit, does the nav show the new username?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id1
+
+            c.get('/users/profile')
+
+            c.post('/users/profile', data={
+                "username": "renamed",
+                "email": "test@test.com",
+                "image_url": "/static/images/default-pic.png",
+                "header_image_url": "",
+                "bio": "",
+                "password": "testuser",
+            })
+
+            resp = c.get('/messages/new')
+            self.assertIn('alt="renamed"', resp.get_data(as_text=True))
+
+    def test_public_profile_conditional(self):
+        """Does a logged-out profile view answer a matching If-None-Match
+        with a 304, and change its ETag when the user posts?"""
+
+        with self.client as c:
+            resp = c.get(f'/users/{self.test_user_id1}')
+            etag = resp.headers['ETag']
+
+            self.assertIn('public', resp.headers['Cache-Control'])
+            self.assertIn('Last-Modified', resp.headers)
+
+            resp = c.get(f'/users/{self.test_user_id1}',
+                         headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id1
+            c.post('/messages/new', data={"text": "Newer warble"})
+            with c.session_transaction() as sess:
+                del sess[CURR_USER_KEY]
+                sess.pop('_flashes', None)
+
+            resp = c.get(f'/users/{self.test_user_id1}',
+                         headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_logged_in_pages_private(self):
+        """Are pages for a logged-in user cached privately only?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.test_user_id1
+
+            resp = c.get(f'/users/{self.test_user_id1}')
+
+            self.assertIn('private', resp.headers['Cache-Control'])
+            self.assertNotIn('ETag', resp.headers)
+
+    def test_static_files_cacheable(self):
+        """Are static files given long-lived public caching?"""
+
+        with self.client as c:
+            resp = c.get('/static/stylesheets/style.css')
+
+            self.assertIn('public', resp.headers['Cache-Control'])
+            self.assertIn(f"max-age={app.config['STATIC_MAX_AGE']}",
+                          resp.headers['Cache-Control'])
+            resp.close()
@@ -0,0 +1,205 @@
+"""Materialized home timelines for Warbler.
+
+Each user's home feed is kept in the `timelines` table. When a message is
+posted its id is copied into every follower's timeline (fan-out on write),
+so reading the home page is one indexed range scan no matter how many
+accounts a user follows.
+
+Accounts with more than TIMELINE_FANOUT_LIMIT followers are flagged
+`fanout_on_read`; their messages are not copied out, and are merged into
+followers' feeds when the feed is read instead.
+"""
+
+from flask import current_app
+from sqlalchemy import insert, literal, tuple_, union
+from sqlalchemy.orm import joinedload
+
+from models import db, User, Message, Follows, TimelineEntry
+
+DEFAULT_FANOUT_LIMIT = 10000
+DEFAULT_BACKFILL_SIZE = 100
+
+
+def _fanout_limit():
+    return current_app.config.get('TIMELINE_FANOUT_LIMIT',
+                                  DEFAULT_FANOUT_LIMIT)
+
+
+def _backfill_size():
+    return current_app.config.get('TIMELINE_BACKFILL_SIZE',
+                                  DEFAULT_BACKFILL_SIZE)
+
+
+def fan_out_message(msg):
+    """Add a newly created message to its author's and followers' timelines.
+
+    The message must already be flushed so it has an id.
+    """
+
+    author = msg.user or User.query.get(msg.user_id)
+
+    db.session.add(TimelineEntry(user_id=msg.user_id,
+                                 message_id=msg.id,
+                                 author_id=msg.user_id,
+                                 timestamp=msg.timestamp))
+
+    if author.fanout_on_read:
+        return
+
+    followers = (db.session
+                 .query(Follows.user_following_id,
+                        literal(msg.id),
+                        literal(msg.user_id),
+                        literal(msg.timestamp))
+                 .filter(Follows.user_being_followed_id == msg.user_id))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'],
+            followers))
+
+
+def backfill(follower_id, followed_id):
+    """Copy the recent messages of `followed_id` into a new follower's
+    timeline, and switch the followed account to fan-out on read once it
+    grows past the fan-out limit."""
+
+    followed = User.query.get(followed_id)
+
+    if not followed.fanout_on_read:
+        num_followers = (db.session
+                         .query(User.followers_count)
+                         .filter(User.id == followed_id)
+                         .scalar())
+        if num_followers > _fanout_limit():
+            followed.fanout_on_read = True
+
+    if followed.fanout_on_read:
+        return
+
+    recent = (db.session
+              .query(literal(follower_id),
+                     Message.id,
+                     Message.user_id,
+                     Message.timestamp)
+              .filter(Message.user_id == followed_id)
+              .order_by(Message.timestamp.desc())
+              .limit(_backfill_size()))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'],
+            recent))
+
+
+def prune(follower_id, followed_id):
+    """Remove a no-longer-followed user's messages from a timeline."""
+
+    (TimelineEntry.query
+     .filter(TimelineEntry.user_id == follower_id,
+             TimelineEntry.author_id == followed_id)
+     .delete(synchronize_session=False))
+
+
+def remove_message(message_id):
+    """Remove a message from every timeline it was fanned out to."""
+
+    (TimelineEntry.query
+     .filter(TimelineEntry.message_id == message_id)
+     .delete(synchronize_session=False))
+
+
+def home_timeline(user_id, limit=100, before=None):
+    """Return the most recent messages in a user's home timeline.
+
+    Reads the materialized timeline and merges in the messages of any
+    followed accounts that are fanned out on read. Authors are loaded in
+    the same query as the messages. `before` is an optional
+    (timestamp, id) key; only messages older than it are returned.
+    """
+
+    fanned_out = (db.session
+                  .query(TimelineEntry.message_id.label('id'),
+                         TimelineEntry.timestamp.label('timestamp'))
+                  .filter(TimelineEntry.user_id == user_id))
+
+    pulled = (db.session
+              .query(Message.id.label('id'),
+                     Message.timestamp.label('timestamp'))
+              .join(Follows, Follows.user_being_followed_id == Message.user_id)
+              .join(User, User.id == Follows.user_being_followed_id)
+              .filter(Follows.user_following_id == user_id,
+                      User.fanout_on_read.is_(True)))
+
+    if before:
+        fanned_out = fanned_out.filter(
+            tuple_(TimelineEntry.timestamp, TimelineEntry.message_id) < before)
+        pulled = pulled.filter(tuple_(Message.timestamp, Message.id) < before)
+
+    fanned_out = (fanned_out
+                  .order_by(TimelineEntry.timestamp.desc(),
+                            TimelineEntry.message_id.desc())
+                  .limit(limit))
+
+    pulled = (pulled
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(limit))
+
+    feed = union(fanned_out.subquery().select(),
+                 pulled.subquery().select()).subquery()
+
+    message_ids = [
+        row.id for row in db.session.execute(
+            db.select(feed.c.id)
+            .order_by(feed.c.timestamp.desc(), feed.c.id.desc())
+            .limit(limit))
+    ]
+
+    if not message_ids:
+        return []
+
+    position = {message_id: i for i, message_id in enumerate(message_ids)}
+    messages = (Message.query
+                .options(joinedload(Message.user))
+                .filter(Message.id.in_(message_ids))
+                .all())
+    messages.sort(key=lambda m: position[m.id])
+    return messages
+
+
+def rebuild_timelines():
+    """Rebuild every timeline from `messages` and `follows`.
+
+    Used after bulk loads (e.g. seed.py) that bypass the routes.
+    """
+
+    TimelineEntry.query.delete(synchronize_session=False)
+
+    popular = (db.session
+               .query(Follows.user_being_followed_id)
+               .group_by(Follows.user_being_followed_id)
+               .having(db.func.count() > _fanout_limit()))
+
+    (User.query
+     .filter(User.id.in_(popular))
+     .update({User.fanout_on_read: True}, synchronize_session=False))
+
+    own = db.session.query(Message.user_id,
+                           Message.id,
+                           Message.user_id,
+                           Message.timestamp)
+
+    followed = (db.session
+                .query(Follows.user_following_id,
+                       Message.id,
+                       Message.user_id,
+                       Message.timestamp)
+                .join(Message, Message.user_id == Follows.user_being_followed_id)
+                .join(User, User.id == Message.user_id)
+                .filter(User.fanout_on_read.is_(False)))
+
+    for rows in (own, followed):
+        db.session.execute(
+            insert(TimelineEntry).from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                rows))